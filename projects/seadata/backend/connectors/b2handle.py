@@ -8,12 +8,31 @@
 
 from b2handle.clientcredentials import PIDClientCredentials as credentials
 from b2handle.handleclient import EUDATHandleClient as b2handle
+from requests.adapters import HTTPAdapter
 from restapi.utilities.logs import log
 from seadata.connectors import irods
 
 HandleClient = Any
 
 
+def enable_connection_pool(client: HandleClient, size: int) -> None:
+    """
+    Let up to size threads share the keep-alive connections of the client.
+    The requests session is private to the b2handle connector: if it can't
+    be found the client is left unchanged, with its default pool
+    """
+
+    connector = getattr(client, "_EUDATHandleClient__handlesystemconnector", None)
+    session = getattr(connector, "_HandleSystemConnector__session", None)
+    if session is None:
+        log.warning("Can't configure the connection pool of the B2HANDLE client")
+        return
+
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
 class PIDgenerator:
     """
     Handling PID requests.
@@ -6,11 +6,13 @@
 import re
 import textwrap
 from pathlib import Path
-from typing import Any, Dict, Iterator, Optional, Union, cast
+from typing import Any, Dict, Iterator, List, Optional, Union, cast
 
 from flask import Response, stream_with_context
 from irods import exception as iexceptions
+from irods import models
 from irods.access import iRODSAccess
+from irods.column import Like
 from irods.rule import Rule
 from irods.session import iRODSSession
 from irods.ticket import Ticket
@@ -28,6 +30,7 @@
 NORMAL_AUTH_SCHEME = "credentials"
 PAM_AUTH_SCHEME = "PAM"
 DEFAULT_CHUNK_SIZE = 1_048_576
+DOWNLOAD_CHUNK_SIZE = 4_194_304
 
 
 class IrodsException(RestApiException):
@@ -153,7 +156,7 @@ def is_dataobject(self, path: Union[str, Path]) -> bool:
         except iexceptions.DataObjectDoesNotExist:
             return False
 
-    def get_dataobject(self, path: Path) -> DataObject:
+    def get_dataobject(self, path: Union[str, Path]) -> DataObject:
         try:
             return self.prc.data_objects.get(str(path))
         except (iexceptions.CollectionDoesNotExist, iexceptions.DataObjectDoesNotExist):
@@ -221,6 +224,63 @@ def list(
         #     replicas.append(re.split("\s+", line.strip()))
         # return replicas
 
+    @staticmethod
+    def get_tree_criteria(path: str) -> List[Any]:
+        """
+        Query criteria matching a collection and all the nested ones.
+        _ and % in path are LIKE wildcards: the pattern can also match
+        sibling collections, rows are to be checked with in_tree
+        """
+        path = path.rstrip("/")
+        return [
+            models.Collection.name == path,
+            Like(models.Collection.name, f"{path}/%"),
+        ]
+
+    @staticmethod
+    def in_tree(path: str, collection: str) -> bool:
+        """Verify if collection is path or one of its nested collections"""
+        path = path.rstrip("/")
+        return collection == path or collection.startswith(f"{path}/")
+
+    def list_files(self, path: str) -> List[str]:
+        """Recursively list the paths of all data objects inside a collection"""
+
+        if not self.is_collection(path):
+            raise IrodsException(f"Not found (or no permission): {path}")
+
+        data: List[str] = []
+        # A catalog query on the collection and all the nested ones,
+        # instead of listing (and checking) each collection separately
+        for criterion in self.get_tree_criteria(path):
+            query = self.prc.query(models.Collection.name, models.DataObject.name)
+            for row in query.filter(criterion):
+                collection = row[models.Collection.name]
+                if self.in_tree(path, collection):
+                    data.append(f"{collection}/{row[models.DataObject.name]}")
+        return data
+
+    def get_tree_metadata(self, path: str, name: str) -> Dict[str, str]:
+        """
+        Retrieve the value of a metadata for all data objects inside a collection
+        (nested collections included), with a single catalog query
+        """
+
+        data: Dict[str, str] = {}
+        for criterion in self.get_tree_criteria(path):
+            query = self.prc.query(
+                models.Collection.name,
+                models.DataObject.name,
+                models.DataObjectMeta.value,
+            )
+            query = query.filter(criterion, models.DataObjectMeta.name == name)
+            for row in query:
+                collection = row[models.Collection.name]
+                if self.in_tree(path, collection):
+                    ipath = f"{collection}/{row[models.DataObject.name]}"
+                    data[ipath] = row[models.DataObjectMeta.value]
+        return data
+
     def create_empty(
         self, path: str, directory: bool = False, ignore_existing: bool = False
     ) -> bool:
@@ -335,9 +395,8 @@ def write_file_content(self, path: str, content: str, position: int = 0) -> None
                 if handle.writable():
 
                     # handle.write('foo\nbar\n')
-                    a_buffer = bytearray()
-                    a_buffer.extend(map(ord, content))
-                    handle.write(a_buffer)
+                    # encode in a single call instead of one ord() per char
+                    handle.write(content.encode("utf-8"))
                 handle.close()
         except iexceptions.DataObjectDoesNotExist:
             raise IrodsException("Cannot write to file: not found")
@@ -347,10 +406,15 @@ def open(self, absolute_path: str, destination: str) -> None:
         try:
             obj = self.prc.data_objects.get(absolute_path)
 
+            # iRODS handles have no file descriptor to be used with sendfile,
+            # copy in large chunks instead of iterating over "lines".
+            # Each read is a round-trip to the server: a single large buffer
+            # is reused for all of them, without allocating a chunk per read
+            buffer = memoryview(bytearray(DOWNLOAD_CHUNK_SIZE))
             with obj.open("r") as handle:
                 with open(destination, "wb") as target:
-                    for line in handle:
-                        target.write(line)
+                    while size := handle.readinto(buffer):
+                        target.write(buffer[:size])
 
         except iexceptions.DataObjectDoesNotExist:
             raise IrodsException("Cannot read path: not found or permssion denied")
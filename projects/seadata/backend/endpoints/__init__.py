@@ -395,14 +395,14 @@ class Metadata:
     }"""
 
     tid = "temp_id"
-    keys = [
+    keys = (
         "cdi_n_code",
         "format_n_code",
         "data_format_l24",
         "version",
         "batch_date",
         "test_mode",
-    ]
+    )
     max_size = 10
 
 
@@ -410,11 +410,16 @@ class ImportManagerAPI:
 
     _uri = seadata_vars.get("api_im_url")
 
+    def __init__(self) -> None:
+        # Keep-alive connection reused by all the notifications of a worker
+        self._session = requests.Session()
+
     def post(
         self,
         payload: Dict[str, Any],
         backdoor: bool = False,
         edmo_code: Optional[int] = None,
+        raise_on_server_error: bool = False,
     ) -> bool:
 
         # timestamp '20180320T08:15:44' = YYMMDDTHH:MM:SS
@@ -447,9 +452,13 @@ def post(
             log.error("Invalid external APIs URI")
             return False
 
-        r = requests.post(self._uri, json=payload, timeout=30)
+        r = self._session.post(self._uri, json=payload, timeout=30)
         log.info("POST external IM API, status={}, uri={}", r.status_code, self._uri)
 
+        if r.status_code >= 500 and raise_on_server_error:
+            # let the caller retry, the server could be temporarily unavailable
+            r.raise_for_status()
+
         if r.status_code != 200:
             log.error(
                 "CDI: failed to call external APIs (status: {}, uri: {})",
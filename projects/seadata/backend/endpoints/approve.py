@@ -48,7 +48,7 @@ def post(self, batch_id: str, user: User, **json_input: Any) -> Response:
                 )
 
             # print("TEST", data)
-            for key in md.keys:  # + [md.tid]:
+            for key in md.keys:  # + (md.tid,):
                 value = data.get(key)
                 if value is None:
                     raise BadRequest(f"Missing parameter: {key}")
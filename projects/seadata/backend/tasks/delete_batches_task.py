@@ -8,7 +8,7 @@
 from restapi.utilities.processes import start_timeout, stop_timeout
 from seadata.connectors import irods
 from seadata.endpoints import ErrorCodes
-from seadata.tasks.seadata import ext_api, notify_error
+from seadata.tasks.seadata import error_entry, ext_api, notify_error
 
 TIMEOUT = 1800
 
@@ -65,13 +65,7 @@ def delete_batches(
                 try:
                     start_timeout(TIMEOUT)
                     if not imain.is_collection(batch_path):
-                        errors.append(
-                            {
-                                "error": ErrorCodes.BATCH_NOT_FOUND[0],
-                                "description": ErrorCodes.BATCH_NOT_FOUND[1],
-                                "subject": batch,
-                            }
-                        )
+                        errors.append(error_entry(ErrorCodes.BATCH_NOT_FOUND, batch))
 
                         self.update_state(
                             state="PROGRESS",
@@ -87,13 +81,7 @@ def delete_batches(
                     stop_timeout()
                 except BaseException as e:
                     log.error(e)
-                    errors.append(
-                        {
-                            "error": ErrorCodes.UNEXPECTED_ERROR[0],
-                            "description": ErrorCodes.UNEXPECTED_ERROR[1],
-                            "subject": batch,
-                        }
-                    )
+                    errors.append(error_entry(ErrorCodes.UNEXPECTED_ERROR, batch))
                     self.update_state(
                         state="PROGRESS",
                         meta={"total": total, "step": counter, "errors": len(errors)},
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from shutil import rmtree
 from typing import Any, Dict, List
@@ -8,7 +9,7 @@
 from restapi.utilities.processes import start_timeout, stop_timeout
 from seadata.connectors import irods
 from seadata.endpoints import ErrorCodes
-from seadata.tasks.seadata import ext_api, notify_error
+from seadata.tasks.seadata import error_entry, ext_api, notify_error
 
 TIMEOUT = 1800
 
@@ -47,7 +48,9 @@ def delete_orders(
         return notify_error(ErrorCodes.EMPTY_ORDERS_PARAMETER, myjson, backdoor, self)
 
     try:
-        with irods.get_instance() as imain:
+        # Local folders are removed by a background thread, overlapping with
+        # the next iRODS removals and with the final CDI notification
+        with irods.get_instance() as imain, ThreadPoolExecutor(1) as cleaner:
 
             errors: List[Dict[str, str]] = []
             counter = 0
@@ -67,13 +70,7 @@ def delete_orders(
                 try:
                     start_timeout(TIMEOUT)
                     if not imain.is_collection(order_path):
-                        errors.append(
-                            {
-                                "error": ErrorCodes.ORDER_NOT_FOUND[0],
-                                "description": ErrorCodes.ORDER_NOT_FOUND[1],
-                                "subject": order,
-                            }
-                        )
+                        errors.append(error_entry(ErrorCodes.ORDER_NOT_FOUND, order))
 
                         self.update_state(
                             state="PROGRESS",
@@ -95,13 +92,7 @@ def delete_orders(
                     stop_timeout()
                 except BaseException as e:
                     log.error(e)
-                    errors.append(
-                        {
-                            "error": ErrorCodes.UNEXPECTED_ERROR[0],
-                            "description": ErrorCodes.UNEXPECTED_ERROR[1],
-                            "subject": order,
-                        }
-                    )
+                    errors.append(error_entry(ErrorCodes.UNEXPECTED_ERROR, order))
                     self.update_state(
                         state="PROGRESS",
                         meta={"total": total, "step": counter, "errors": len(errors)},
@@ -109,7 +100,7 @@ def delete_orders(
                     continue
 
                 if local_order_path.is_dir():
-                    rmtree(local_order_path, ignore_errors=True)
+                    cleaner.submit(rmtree, local_order_path, ignore_errors=True)
 
             if len(errors) > 0:
                 myjson["errors"] = errors
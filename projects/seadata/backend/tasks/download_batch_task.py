@@ -1,4 +1,5 @@
 import hashlib
+import os
 import zipfile
 from pathlib import Path
 from shutil import rmtree
@@ -274,7 +275,9 @@ def download_batch(
                 zip_ref.close()
 
             # 6 - verify num files?
-            local_file_count = len(list(local_unzipdir.iterdir()))
+            # Count the entries without building a list of Path objects
+            with os.scandir(local_unzipdir) as entries:
+                local_file_count = sum(1 for _ in entries)
 
             log.info("Unzipped {} files from {}", local_file_count, batch_file)
 
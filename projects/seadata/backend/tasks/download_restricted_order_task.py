@@ -1,23 +1,30 @@
 import hashlib
 import os
-import re
 import zipfile
 from pathlib import Path
 from shutil import rmtree
 from typing import Any, Dict, List, Optional, Tuple
 
 import requests
-from plumbum import local  # type: ignore
-from plumbum.commands.processes import ProcessExecutionError  # type: ignore
+from requests.adapters import HTTPAdapter
 from restapi.connectors.celery import CeleryExt, Task
 from restapi.utilities.logs import log
 from restapi.utilities.processes import start_timeout, stop_timeout
 from seadata.connectors import irods
 from seadata.connectors.irods import IrodsException
 from seadata.endpoints import MOUNTPOINT, ORDERS_DIR, ErrorCodes
-from seadata.tasks.seadata import MAX_ZIP_SIZE, ext_api, notify_error
+from seadata.tasks.seadata import (
+    MAX_ZIP_SIZE,
+    EntryTooLargeError,
+    copy_zip_entry,
+    ext_api,
+    notify_error,
+    split_zip,
+)
 
 TIMEOUT = 1800
+DOWNLOAD_CHUNK_SIZE = 1_048_576
+
 
 DOWNLOAD_HEADERS = {
     "User-Agent": "SDC CDI HTTP-APIs",
@@ -28,6 +35,14 @@
     "Accept-Encoding": "gzip, deflate",
 }
 
+# Reuse connections (and TLS handshakes) across downloads from the same partner
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+http_session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+# posix_fadvise (and its POSIX_FADV_* constants) is not available on every platform
+HAS_FADVISE = hasattr(os, "posix_fadvise")
+
 
 def check_params(params: Dict[str, Any]) -> Optional[Tuple[str, str]]:
     params_to_check = [
@@ -60,6 +75,19 @@ def check_params(params: Dict[str, Any]) -> Optional[Tuple[str, str]]:
     return None
 
 
+def drop_page_cache(path: Path) -> None:
+    if not HAS_FADVISE:
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
 @CeleryExt.task(idempotent=False)
 def download_restricted_order(
     self: Task[[str, str, Dict[str, Any]], str],
@@ -168,7 +196,7 @@ def download_restricted_order(
             download_url = os.path.join(download_path, file_name)
             log.info("Downloading file from {}", download_url)
             try:
-                r = requests.get(
+                r = http_session.get(
                     download_url,
                     stream=True,
                     verify=False,
@@ -197,6 +225,7 @@ def download_restricted_order(
 
             if r.status_code != 200:
 
+                r.close()
                 return notify_error(
                     ErrorCodes.UNREACHABLE_DOWNLOAD_PATH,
                     myjson,
@@ -215,18 +244,28 @@ def download_restricted_order(
             local_zip_path = local_dir.joinpath(file_name)
             log.info("partial_zip = {}", local_zip_path)
 
+            # Read straight from the underlying urllib3 response to skip the
+            # per-chunk overhead of iter_content.
+            # The checksum is computed while downloading, to avoid reading
+            # the whole file again from the disk.
+            # MD5 is only used because it is the checksum sent by the partner:
+            # internal integrity checks should rather rely on a faster hash
+            md5 = hashlib.md5()
             with open(local_zip_path, "wb") as f:
-                for chunk in r.iter_content(chunk_size=1024):
-                    if chunk:  # filter out keep-alive new chunks
-                        f.write(chunk)
+                if HAS_FADVISE:
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                for chunk in r.raw.stream(DOWNLOAD_CHUNK_SIZE, decode_content=True):
+                    md5.update(chunk)
+                    f.write(chunk)
+            # release the connection back to the pool
+            r.close()
 
             # 2 - verify checksum
-            log.info("Computing checksum for {}...", local_zip_path)
-            local_file_checksum = hashlib.md5(
-                open(local_zip_path, "rb").read()
-            ).hexdigest()
+            local_file_checksum = md5.hexdigest()
 
             if local_file_checksum.lower() != file_checksum.lower():
+                # do not leave invalid (and possibly huge) files behind
+                local_zip_path.unlink()
                 return notify_error(
                     ErrorCodes.CHECKSUM_DOESNT_MATCH,
                     myjson,
@@ -257,21 +296,15 @@ def download_restricted_order(
 
             log.info("File size verified for {}", local_zip_path)
 
-            # 4 - decompress
-            d = os.path.splitext(os.path.basename(str(local_zip_path)))[0]
-            local_unzipdir = local_dir.joinpath(d)
-
-            if local_unzipdir.exists():
-                log.warning("{} already exist, removing it", local_unzipdir)
-                rmtree(local_unzipdir, ignore_errors=True)
-
-            local_unzipdir.mkdir()
-            log.info("Local unzip dir = {}", local_unzipdir)
-
-            log.info("Unzipping {}", local_zip_path)
-            zip_ref = None
+            # 4 - verify num files?
+            # only the central directory is read, no need to decompress the zip.
+            # The expected count refers to the top-level entries of the
+            # extracted zip, i.e. the distinct first components of the names
             try:
-                zip_ref = zipfile.ZipFile(local_zip_path, "r")
+                with zipfile.ZipFile(local_zip_path, "r") as partial_zip:
+                    local_file_count = len(
+                        {name.split("/")[0] for name in partial_zip.namelist()}
+                    )
             except FileNotFoundError:
                 return notify_error(
                     ErrorCodes.UNZIP_ERROR_FILE_NOT_FOUND,
@@ -292,14 +325,7 @@ def download_restricted_order(
                     edmo_code=request_edmo_code,
                 )
 
-            if zip_ref is not None:
-                zip_ref.extractall(str(local_unzipdir))
-                zip_ref.close()
-
-            # 5 - verify num files?
-            local_file_count = len(os.listdir(str(local_unzipdir)))
-
-            log.info("Unzipped {} files from {}", local_file_count, local_zip_path)
+            log.info("Found {} files in {}", local_file_count, local_zip_path)
 
             if local_file_count != int(file_count):
                 log.error("Expected {} files for {}", file_count, local_zip_path)
@@ -315,9 +341,9 @@ def download_restricted_order(
             log.info("File count verified for {}", local_zip_path)
 
             log.info("Verifying final zip: {}", final_zip)
-            # 6 - check if final_zip exists
+            # 5 - check if final_zip exists
             if not imain.exists(str(final_zip)):
-                # 7 - if not, simply copy partial_zip -> final_zip
+                # 6 - if not, simply copy partial_zip -> final_zip
                 log.info("Final zip does not exist, copying partial zip")
                 try:
                     start_timeout(TIMEOUT)
@@ -345,7 +371,7 @@ def download_restricted_order(
                     )
                 local_finalzip_path = local_zip_path
             else:
-                # 8 - if already exists merge zips
+                # 7 - if already exists merge zips
                 log.info("Already exists, merge zip files")
 
                 log.info("Copying zipfile locally")
@@ -394,11 +420,10 @@ def download_restricted_order(
                 log.info("Adding files to local zipfile")
                 if zip_ref is not None:
                     try:
-                        for loc_file in os.listdir(str(local_unzipdir)):
-                            # log.debug("Adding {}", loc_file)
-                            zip_ref.write(
-                                os.path.join(str(local_unzipdir), loc_file), loc_file
-                            )
+                        with zipfile.ZipFile(local_zip_path, "r") as partial_zip:
+                            for info in partial_zip.infolist():
+                                # log.debug("Adding {}", info.filename)
+                                copy_zip_entry(partial_zip, info, zip_ref)
                         zip_ref.close()
                     except BaseException as e:
                         log.error(e)
@@ -415,6 +440,9 @@ def download_restricted_order(
                 try:
                     start_timeout(TIMEOUT)
                     backup_zip = final_zip.with_suffix(".bak")
+                    # The existence is checked in advance: move() wraps every
+                    # failure as IrodsException, a failed rename does not tell
+                    # if the backup exists or if something else went wrong
                     if imain.is_dataobject(backup_zip):
                         log.info(
                             "{} already exists, removing previous backup",
@@ -424,6 +452,7 @@ def download_restricted_order(
                     imain.move(final_zip, backup_zip)
 
                     log.info("Uploading final updated zip")
+                    # NOTE: put always overwrites
                     imain.put(str(local_finalzip_path), str(final_zip))
                     stop_timeout()
                 except BaseException as e:
@@ -438,7 +467,6 @@ def download_restricted_order(
                     )
 
                 # imain.remove(local_zip_path)
-            rmtree(local_unzipdir, ignore_errors=True)
 
             self.update_state(state="COMPLETED")
 
@@ -454,35 +482,19 @@ def download_restricted_order(
                 split_path.mkdir()
 
                 # Execute the split of the whole zip
-                split_params = [
-                    "-n",
-                    MAX_ZIP_SIZE,
-                    "-b",
-                    str(split_path),
-                    local_finalzip_path,
-                ]
                 try:
-                    zipsplit = local["/usr/bin/zipsplit"]
-                    zipsplit(split_params)
-                except ProcessExecutionError as e:
-
-                    if "Entry is larger than max split size" in e.stdout:
-                        reg = r"Entry too big to split, read, or write \((.*)\)"
-                        extra = None
-                        m = re.search(reg, e.stdout)
-                        if m:
-                            extra = m.group(1)
-                        return notify_error(
-                            ErrorCodes.ZIP_SPLIT_ENTRY_TOO_LARGE,
-                            myjson,
-                            backdoor,
-                            self,
-                            extra=extra,
-                            edmo_code=request_edmo_code,
-                        )
-                    else:
-                        log.error(e.stdout)
-
+                    subzip_paths = split_zip(local_finalzip_path, split_path)
+                except EntryTooLargeError as e:
+                    return notify_error(
+                        ErrorCodes.ZIP_SPLIT_ENTRY_TOO_LARGE,
+                        myjson,
+                        backdoor,
+                        self,
+                        extra=str(e),
+                        edmo_code=request_edmo_code,
+                    )
+                except BaseException as e:
+                    log.error(e)
                     return notify_error(
                         ErrorCodes.ZIP_SPLIT_ERROR,
                         myjson,
@@ -492,21 +504,9 @@ def download_restricted_order(
                         edmo_code=request_edmo_code,
                     )
 
-                regexp = "^.*[^0-9]([0-9]+).zip$"
-                zip_files = os.listdir(split_path)
-                for subzip_file in zip_files:
-                    m = re.search(regexp, subzip_file)
-                    if not m:
-                        log.error("Cannot extract index from zip name: {}", subzip_file)
-                        return notify_error(
-                            ErrorCodes.INVALID_ZIP_SPLIT_OUTPUT,
-                            myjson,
-                            backdoor,
-                            self,
-                            extra=str(local_finalzip_path),
-                        )
-                    index = m.group(1).lstrip("0")
-                    subzip_path = split_path.joinpath(subzip_file)
+                # The parts are returned in order: no need to list the
+                # split folder and parse the index back from the names
+                for index, subzip_path in enumerate(subzip_paths, start=1):
 
                     subzip_ifile = f"{base_filename}{index}.zip"
                     subzip_ipath = Path(order_path, subzip_ifile)
@@ -527,6 +527,11 @@ def download_restricted_order(
                             edmo_code=request_edmo_code,
                         )
 
+            # Local zips are transient, do not let them pollute the page cache
+            drop_page_cache(local_zip_path)
+            if local_finalzip_path and local_finalzip_path != local_zip_path:
+                drop_page_cache(local_finalzip_path)
+
             if len(errors) > 0:
                 myjson["errors"] = errors
 
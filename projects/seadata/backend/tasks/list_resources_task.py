@@ -32,20 +32,13 @@ def list_resources(
             params = myjson.get(param_key, {})
             backdoor = params.pop("backdoor", False)
 
-            if param_key not in myjson:
-                myjson[param_key] = {}
-
-            myjson[param_key]["batches"] = []
             try:
                 start_timeout(TIMEOUT)
-                batches = imain.list(batch_path)
-                for n in batches:
-                    myjson[param_key]["batches"].append(n)
-
-                myjson[param_key]["orders"] = []
-                orders = imain.list(order_path)
-                for n in orders:
-                    myjson[param_key]["orders"].append(n)
+                # The iRODS session can't be shared across threads and the
+                # timeout must be able to interrupt the listings: keep them
+                # sequential, in the task thread
+                myjson[param_key]["batches"] = list(imain.list(batch_path))
+                myjson[param_key]["orders"] = list(imain.list(order_path))
 
                 ret = ext_api.post(myjson, backdoor=backdoor)
                 log.info("CDI IM CALL = {}", ret)
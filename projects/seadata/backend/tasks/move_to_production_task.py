@@ -1,22 +1,51 @@
 import json
+import os
 import time
-from pathlib import Path
-from typing import Any, Dict, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
 
 from restapi.connectors import redis
 from restapi.connectors.celery import CeleryExt, Task
 from restapi.utilities.logs import log
-from restapi.utilities.processes import start_timeout, stop_timeout
 from seadata.connectors import irods
 from seadata.connectors.b2handle import PIDgenerator
 from seadata.connectors.rabbit_queue import prepare_message
 from seadata.endpoints import INGESTION_DIR, MOUNTPOINT, ErrorCodes
 from seadata.endpoints import Metadata as md
-from seadata.tasks.seadata import ext_api, notify_error
+from seadata.tasks.seadata import (
+    REDIS_BATCH_SIZE,
+    cache_pids,
+    error_entry,
+    notify_error,
+)
 
 pmaker = PIDgenerator()
 
 TIMEOUT = 1800
+MAX_RETRIES = 5
+SLEEP_TIME = 120
+# Progress is sent to the result backend once every N elements
+UPDATE_STATE_EVERY = 50
+# Number of files concurrently uploaded on iRODS
+UPLOAD_WORKERS = 4
+
+
+def upload_file(imain: irods.IrodsPythonExt, local_element: str, ifile: str) -> bool:
+    """
+    Copy a local file on irods, retrying on failures.
+    It runs in a worker thread: stuck transfers are interrupted
+    by the irods session socket timeout
+    """
+    for i in range(MAX_RETRIES):
+        try:
+            imain.put(local_element, ifile)
+            log.info("File copied on irods: {}", ifile)
+            return True
+        except BaseException as e:
+            log.error(e)
+            time.sleep(SLEEP_TIME)
+    return False
 
 
 @CeleryExt.task(idempotent=False)
@@ -55,194 +84,174 @@ def move_to_production_task(
                     ErrorCodes.MISSING_PIDS_LIST, myjson, backdoor, self
                 )
 
-            MAX_RETRIES = 5
-            SLEEP_TIME = 120
-
             r = redis.get_instance().r
+            new_pids: List[Tuple[str, str]] = []
+
+            # The uploads run concurrently in a thread pool and are collected
+            # in order, overlapping with the PID and metadata requests
+            with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+                try:
+                    uploads: List[Tuple[str, str, Optional["Future[bool]"]]] = []
+                    # Plain strings and os.path: no Path objects built per element
+                    local_dir = str(local_path)
+                    for element in elements:
+                        temp_id = element.get("temp_id")  # do not pop
+                        local_element = os.path.join(local_dir, temp_id)
+                        ifile = os.path.join(
+                            cloud_path, os.path.basename(local_element)
+                        )
+                        # Exists and has size greater than zero (with a single stat)
+                        try:
+                            found = os.stat(local_element).st_size > 0
+                        except OSError:
+                            found = False
+                        if found:
+                            log.info("Found: {}", local_element)
+                            uploaded = executor.submit(
+                                upload_file, imain, local_element, ifile
+                            )
+                            uploads.append((local_element, ifile, uploaded))
+                        else:
+                            uploads.append((local_element, ifile, None))
+
+                    for position, element in enumerate(elements):
+
+                        if position > 0 and position % UPDATE_STATE_EVERY == 0:
+                            self.update_state(
+                                state="PROGRESS",
+                                meta={
+                                    "total": total,
+                                    "step": counter,
+                                    "errors": len(errors),
+                                },
+                            )
+
+                        record_id = element.get("format_n_code")
+                        local_element, ifile, uploaded = uploads[position]
+                        # it is not equal to temp_id !?
+                        current_file_name = os.path.basename(local_element)
+
+                        # [fs -> irods]
+                        if uploaded is None:
+                            log.error("NOT found: {}", local_element)
+                            errors.append(
+                                error_entry(
+                                    ErrorCodes.INGESTION_FILE_NOT_FOUND, record_id
+                                )
+                            )
+                            continue
+
+                        ###############
+                        # 1. copy file (irods) [fs -> irods]
+                        # The socket timeout only bounds each iRODS call: the
+                        # whole upload, retries included, is bounded here
+                        try:
+                            copied = uploaded.result(timeout=TIMEOUT)
+                        except FuturesTimeoutError:
+                            log.error("Upload timed out: {}", ifile)
+                            copied = False
+                        if not copied:
+                            # failed upload for the file
+                            errors.append(
+                                error_entry(
+                                    ErrorCodes.UNABLE_TO_MOVE_IN_PRODUCTION, record_id
+                                )
+                            )
+                            continue
+
+                        ###############
+                        # 2. request pid (irule)
+                        for i in range(MAX_RETRIES):
+                            try:
+                                if backdoor:
+                                    log.warning(
+                                        "Backdoor enabled: skipping PID request"
+                                    )
+                                    PID = "NO_PID_WITH_BACKDOOR"
+                                else:
+                                    PID = pmaker.pid_request(imain, ifile)
+                                log.info("PID: {}", PID)
+                                break
+                            except BaseException as e:
+                                log.error(e)
+                                time.sleep(SLEEP_TIME)
+                                continue
 
-            for element in elements:
-
-                temp_id = element.get("temp_id")  # do not pop
-                record_id = element.get("format_n_code")
-                local_element = local_path.joinpath(temp_id)
-                # it is not equal to temp_id !?
-                current_file_name = local_element.name
-
-                # [fs -> irods]
-                # Exists and has size greater than zero
-                if local_element.exists() and local_element.stat().st_size > 0:
-                    log.info("Found: {}", local_element)
-                else:
-                    log.error("NOT found: {}", local_element)
-                    errors.append(
-                        {
-                            "error": ErrorCodes.INGESTION_FILE_NOT_FOUND[0],
-                            "description": ErrorCodes.INGESTION_FILE_NOT_FOUND[1],
-                            "subject": record_id,
-                        }
-                    )
-
-                    self.update_state(
-                        state="PROGRESS",
-                        meta={"total": total, "step": counter, "errors": len(errors)},
-                    )
-                    continue
-
-                ###############
-                # 1. copy file (irods) [fs -> irods]
-                ifile = str(Path(cloud_path, current_file_name))
-                for i in range(MAX_RETRIES):
-                    try:
-                        start_timeout(TIMEOUT)
-                        imain.put(str(local_element), str(ifile))
-                        log.info("File copied on irods: {}", ifile)
-                        stop_timeout()
-                        break
-                    except BaseException as e:
-                        log.error(e)
-                        time.sleep(SLEEP_TIME)
-                        continue
-                else:
-                    # failed upload for the file
-                    errors.append(
-                        {
-                            "error": ErrorCodes.UNABLE_TO_MOVE_IN_PRODUCTION[0],
-                            "description": ErrorCodes.UNABLE_TO_MOVE_IN_PRODUCTION[1],
-                            "subject": record_id,
-                        }
-                    )
-
-                    self.update_state(
-                        state="PROGRESS",
-                        meta={"total": total, "step": counter, "errors": len(errors)},
-                    )
-                    continue
-
-                ###############
-                # 2. request pid (irule)
-                for i in range(MAX_RETRIES):
-                    try:
-                        start_timeout(TIMEOUT)
-                        if backdoor:
-                            log.warning("Backdoor enabled: skipping PID request")
-                            PID = "NO_PID_WITH_BACKDOOR"
                         else:
-                            PID = pmaker.pid_request(imain, ifile)
-                        log.info("PID: {}", PID)
-                        # # save inside the cache
-                        r.set(PID, ifile)
-                        r.set(ifile, PID)
-                        log.debug("PID cache updated")
-                        stop_timeout()
-                        break
-                    except BaseException as e:
-                        log.error(e)
-                        time.sleep(SLEEP_TIME)
-                        continue
-
-                else:
-                    # failed PID assignment
-                    errors.append(
-                        {
-                            "error": ErrorCodes.UNABLE_TO_ASSIGN_PID[0],
-                            "description": ErrorCodes.UNABLE_TO_ASSIGN_PID[1],
-                            "subject": record_id,
-                        }
-                    )
-
-                    self.update_state(
-                        state="PROGRESS",
-                        meta={"total": total, "step": counter, "errors": len(errors)},
-                    )
-                    continue
-
-                ###############
-                # 3. set metadata (icat)
-                # Remove me in a near future
-                for i in range(MAX_RETRIES):
-                    try:
-                        start_timeout(TIMEOUT)
-                        metadata = imain.get_metadata(ifile)
-
-                        for key in md.keys:
-                            if key not in metadata:
-                                value = element.get(key, "***MISSING***")
-                                args = {"path": ifile, key: value}
-                                imain.set_metadata(**args)
-                        log.debug("Metadata set for {}", current_file_name)
-                        stop_timeout()
-                        break
-                    except BaseException as e:
-                        log.error(e)
-                        time.sleep(SLEEP_TIME)
-                        continue
-                else:
-                    # failed metadata setting
-                    errors.append(
-                        {
-                            "error": ErrorCodes.UNABLE_TO_SET_METADATA[0],
-                            "description": ErrorCodes.UNABLE_TO_SET_METADATA[1],
-                            "subject": record_id,
+                            # failed PID assignment
+                            errors.append(
+                                error_entry(ErrorCodes.UNABLE_TO_ASSIGN_PID, record_id)
+                            )
+                            continue
+
+                        # the PID is cached as soon as it is assigned, in batches
+                        new_pids.append((PID, ifile))
+                        if len(new_pids) >= REDIS_BATCH_SIZE:
+                            cache_pids(r, new_pids)
+                            new_pids.clear()
+
+                        ###############
+                        # 3. set metadata (icat) and dump it into a .meta (dataobject)
+                        # The content is built once and both writes share the retries
+                        content = {
+                            key: element.get(key, "***MISSING***") for key in md.keys
                         }
-                    )
-
-                    self.update_state(
-                        state="PROGRESS",
-                        meta={"total": total, "step": counter, "errors": len(errors)},
-                    )
-                    continue
-
-                ###############
-                # 3-bis. set metadata (dataobject)
-                for i in range(MAX_RETRIES):
-                    try:
-                        start_timeout(TIMEOUT)
-                        content = {}
-                        for key in md.keys:
-                            value = element.get(key, "***MISSING***")
-                            content[key] = value
                         content["PID"] = PID
-
                         metadata_file = ifile + ".meta"
-                        imain.create_empty(metadata_file, ignore_existing=True)
-                        imain.write_file_content(metadata_file, json.dumps(content))
-                        log.debug("Metadata dumped in {}", metadata_file)
-                        stop_timeout()
-                        break
-                    except BaseException as e:
-                        log.error(e)
-                        time.sleep(SLEEP_TIME)
-                        continue
-                else:
-                    # failed metadata setting
-                    errors.append(
-                        {
-                            "error": ErrorCodes.UNABLE_TO_SET_METADATA[0],
-                            "description": ErrorCodes.UNABLE_TO_SET_METADATA[1],
-                            "subject": record_id,
-                        }
-                    )
-
-                    self.update_state(
-                        state="PROGRESS",
-                        meta={"total": total, "step": counter, "errors": len(errors)},
-                    )
-                    continue
-                ###############
-                # 4. remove the batch file?
-                # or move it into a "completed/" folder
-                # where we can check if it was already done?
-
-                ###############
-                # 5. add to logs
-                element["pid"] = PID
-                out_data.append(element)
-
-                counter += 1
-                self.update_state(
-                    state="PROGRESS",
-                    meta={"total": total, "step": counter, "errors": len(errors)},
-                )
+
+                        for i in range(MAX_RETRIES):
+                            try:
+                                # Remove me in a near future
+                                # Fetch the data object once and reuse it to both read
+                                # and add the metadata, instead of fetching it again
+                                obj = imain.get_dataobject(ifile)
+                                metadata = obj.metadata.keys()
+
+                                for key in md.keys:
+                                    if key not in metadata:
+                                        obj.metadata.add(key, content[key])
+                                log.debug("Metadata set for {}", current_file_name)
+
+                                imain.create_empty(metadata_file, ignore_existing=True)
+                                imain.write_file_content(
+                                    metadata_file, json.dumps(content)
+                                )
+                                log.debug("Metadata dumped in {}", metadata_file)
+                                break
+                            except BaseException as e:
+                                log.error(e)
+                                time.sleep(SLEEP_TIME)
+                                continue
+                        else:
+                            # failed metadata setting
+                            errors.append(
+                                error_entry(
+                                    ErrorCodes.UNABLE_TO_SET_METADATA, record_id
+                                )
+                            )
+                            continue
+
+                        ###############
+                        # 4. remove the batch file?
+                        # or move it into a "completed/" folder
+                        # where we can check if it was already done?
+
+                        ###############
+                        # 5. add to logs
+                        element["pid"] = PID
+                        out_data.append(element)
+
+                        counter += 1
+                except BaseException:
+                    # The queued uploads are cancelled, while the running ones
+                    # are waited for: they use the iRODS session closed below
+                    executor.shutdown(cancel_futures=True)
+                    raise
+                finally:
+                    # assigned PIDs are cached even if the task fails
+                    cache_pids(r, new_pids)
+
+            log.debug("PID cache updated")
 
             ###############
             # Notify the CDI API
@@ -252,8 +261,15 @@ def move_to_production_task(
                 myjson[key] = value
             if len(errors) > 0:
                 myjson["errors"] = errors
-            ret = ext_api.post(myjson, backdoor=backdoor)
-            log.info("CDI IM CALL = {}", ret)
+            # The CDI notification is sent by a dedicated task, on the notify
+            # queue, so that this worker does not wait on the external API
+            notification = CeleryExt.celery_app.send_task(
+                "notify_cdi",
+                args=[myjson, backdoor],
+                queue="notify",
+                routing_key="notify",
+            )
+            log.info("CDI IM notification queued: {}", notification.id)
 
             out = {
                 "total": total,
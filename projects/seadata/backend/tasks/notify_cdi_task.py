@@ -0,0 +1,45 @@
+from typing import Any, Dict, Optional
+
+import requests
+from restapi.connectors.celery import CeleryExt, Task
+from restapi.utilities.logs import log
+from seadata.tasks.seadata import ext_api
+
+MAX_RETRIES = 5
+# Seconds before the first retry, doubled at each further attempt
+RETRY_BACKOFF = 60
+
+
+@CeleryExt.task(idempotent=False)
+def notify_cdi(
+    self: Task[[Dict[str, Any], bool, Optional[int]], bool],
+    payload: Dict[str, Any],
+    backdoor: bool = False,
+    edmo_code: Optional[int] = None,
+) -> bool:
+
+    try:
+        # post updates the payload in place (e.g. the _ready suffix): a copy is
+        # sent, so that retries are based on the original request args.
+        # Connection errors and 5xx replies are retried, while other
+        # replies are final: the IM API rejected the notification
+        ret = ext_api.post(
+            dict(payload),
+            backdoor=backdoor,
+            edmo_code=edmo_code,
+            raise_on_server_error=True,
+        )
+    except requests.RequestException as e:
+        if self.request.retries >= MAX_RETRIES:
+            log.error("CDI IM notification failed, no more retries: {}", e)
+            raise
+
+        log.warning("CDI IM call failed (attempt {}): {}", self.request.retries, e)
+        raise self.retry(
+            exc=e,
+            countdown=RETRY_BACKOFF * 2**self.request.retries,
+            max_retries=MAX_RETRIES,
+        ) from e
+
+    log.info("CDI IM CALL = {}", ret)
+    return ret
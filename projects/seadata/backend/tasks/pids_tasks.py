@@ -1,27 +1,21 @@
 import os
-from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
+from redis import Redis
 from restapi.connectors import redis
 from restapi.connectors.celery import CeleryExt, Task
 from restapi.utilities.logs import log
 from restapi.utilities.processes import start_timeout, stop_timeout
 from seadata.connectors import irods
+from seadata.tasks.seadata import REDIS_BATCH_SIZE, cache_pids
 
 TIMEOUT = 1800
 
 
 def recursive_list_files(imain: irods.IrodsPythonExt, irods_path: str) -> List[str]:
 
-    data: List[str] = []
-    for current in imain.list(irods_path):
-        ifile = str(Path(irods_path, current))
-        if imain.is_dataobject(ifile):
-            data.append(ifile)
-        else:
-            data.extend(recursive_list_files(imain, ifile))
-
-    return data
+    # A single walk of the collection tree, without checking each entry
+    return imain.list_files(irods_path)
 
 
 @CeleryExt.task(idempotent=False)
@@ -41,6 +35,7 @@ def cache_batch_pids(
     r = redis.get_instance().r
     with irods.get_instance() as imain:
 
+        data: List[str] = []
         try:
             start_timeout(TIMEOUT)
             data = recursive_list_files(imain, irods_path)
@@ -49,64 +44,81 @@ def cache_batch_pids(
         except BaseException as e:
             log.error(e)
 
-        for ifile in data:
-
-            stats["total"] += 1
-
-            pid = r.get(ifile)
-            if pid is not None:
-                stats["skipped"] += 1
-                log.debug(
-                    "{}: file {} already cached with PID: {}",
-                    stats["total"],
-                    ifile,
-                    pid,
-                )
-                self.update_state(state="PROGRESS", meta=stats)
-                continue
-
-            try:
-                start_timeout(TIMEOUT)
-                metadata = imain.get_metadata(ifile)
-                pid = metadata.get("PID")
-                stop_timeout()
-            except BaseException as e:
-                log.error(e)
-
-            if pid is None:
-                stats["errors"] += 1
-                log.warning(
-                    "{}: file {} has not a PID assigned",
-                    stats["total"],
-                    ifile,
-                    pid,
-                )
+        irods_pids: Optional[Dict[str, str]] = None
+        for i in range(0, len(data), REDIS_BATCH_SIZE):
+            chunk = data[i : i + REDIS_BATCH_SIZE]
+            # Check the whole chunk against the cache with a single round-trip
+            cached = r.mget(chunk)
+            new_pids: List[Tuple[str, str]] = []
+
+            for ifile, pid in zip(chunk, cached):
+
+                stats["total"] += 1
+
+                if pid is not None:
+                    stats["skipped"] += 1
+                    log.debug(
+                        "{}: file {} already cached with PID: {}",
+                        stats["total"],
+                        ifile,
+                        pid,
+                    )
+                    self.update_state(state="PROGRESS", meta=stats)
+                    continue
+
+                # The PIDs of the whole tree are read with a single catalog query,
+                # the first time that a file is not found in the cache
+                if irods_pids is None:
+                    irods_pids = {}
+                    try:
+                        start_timeout(TIMEOUT)
+                        irods_pids = imain.get_tree_metadata(irods_path, "PID")
+                        stop_timeout()
+                    except BaseException as e:
+                        log.error(e)
+
+                pid = irods_pids.get(ifile)
+
+                if pid is None:
+                    stats["errors"] += 1
+                    log.warning(
+                        "{}: file {} has not a PID assigned",
+                        stats["total"],
+                        ifile,
+                        pid,
+                    )
+                    self.update_state(state="PROGRESS", meta=stats)
+                    continue
+
+                new_pids.append((pid, ifile))
+                log.debug("{}: file {} cached with PID {}", stats["total"], ifile, pid)
+                stats["cached"] += 1
                 self.update_state(state="PROGRESS", meta=stats)
-                continue
 
-            r.set(pid, ifile)
-            r.set(ifile, pid)
-            log.debug("{}: file {} cached with PID {}", stats["total"], ifile, pid)
-            stats["cached"] += 1
-            self.update_state(state="PROGRESS", meta=stats)
+            cache_pids(r, new_pids)
 
         self.update_state(state="COMPLETED", meta=stats)
         log.info(stats)
     return stats
 
 
-@CeleryExt.task(idempotent=False)
-def inspect_pids_cache(self: Task[[], None]) -> None:
+def inspect_pids(
+    r: Redis, keys: List[str], cache: Dict[str, Dict[str, int]], counter: int
+) -> int:
 
-    log.info("Inspecting cache...")
-    counter = 0
-    cache: Dict[str, Dict[str, int]] = {}
-    r = redis.get_instance().r
+    if not keys:
+        return counter
+
+    # Resolve the whole batch of keys with a single round-trip
+    for key, value in zip(keys, r.mget(keys)):
+        # the key expired or was removed after being scanned
+        if value is None:
+            continue
 
-    for key in r.scan_iter("*"):
-        folder = os.path.dirname(r.get(key))
+        # values are returned as bytes, like the scanned keys
+        folder = os.path.dirname(value.decode())
 
-        prefix = str(key).split("/")[0]
+        prefix = key.split("/")[0]
         if prefix not in cache:
             cache[prefix] = {}
 
@@ -119,6 +131,29 @@ def inspect_pids_cache(self: Task[[], None]) -> None:
         if counter % 10000 == 0:
             log.info("{} pids inspected...", counter)
 
+    return counter
+
+
+@CeleryExt.task(idempotent=False)
+def inspect_pids_cache(self: Task[[], None]) -> None:
+
+    log.info("Inspecting cache...")
+    counter = 0
+    cache: Dict[str, Dict[str, int]] = {}
+    r = redis.get_instance().r
+
+    keys: List[str] = []
+    # PIDs are in the form prefix/suffix: path -> pid mappings (starting with /)
+    # and any other key are skipped server side instead of being fetched
+    for key in r.scan_iter(match="[^/]*/*", count=REDIS_BATCH_SIZE):
+        # scanned keys are bytes: decoded here, to be used as text (and MGET keys)
+        keys.append(key.decode())
+        if len(keys) >= REDIS_BATCH_SIZE:
+            counter = inspect_pids(r, keys, cache, counter)
+            keys.clear()
+
+    counter = inspect_pids(r, keys, cache, counter)
+
     for prefix in cache:
         for pid_path in cache[prefix]:
             log.info(
@@ -1,6 +1,10 @@
+import os
+import struct
+import zipfile
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+from redis import Redis
 from restapi.connectors.celery import CeleryExt, Task
 from restapi.utilities.logs import log
 from seadata.connectors.b2handle import PIDgenerator
@@ -9,6 +13,15 @@
 # Size in bytes
 # TODO: move me into the configuration
 MAX_ZIP_SIZE = 2147483648  # 2 gb
+ZIP_BUFFER_SIZE = 1_048_576
+# Max number of commands sent to redis in a single pipeline
+REDIS_BATCH_SIZE = 1000
+# Local header + central directory record of an entry, filename excluded
+# (zip64 extra fields included, to stay on the safe side)
+ZIP_ENTRY_OVERHEAD = 30 + 46 + 2 * 32
+ZIP_LOCAL_HEADER_SIZE = 30
+ZIP_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+ZIP_DATA_DESCRIPTOR_FLAG = 0x08
 
 ext_api = ImportManagerAPI()
 
@@ -68,3 +81,134 @@ def notify_error(
         task_errors.append(str(extra))
     task.update_state(state="FAILED", meta={"errors": task_errors})
     return "Failed"
+
+
+def error_entry(error: Tuple[str, str], subject: str, **extra: str) -> Dict[str, str]:
+    """
+    Build the description of a single failed item, as listed
+    in the errors of the payload sent to the ImportManagerAPI
+    """
+
+    return {"error": error[0], "description": error[1], "subject": subject, **extra}
+
+
+def cache_pids(r: Redis, pids: Sequence[Tuple[str, str]]) -> None:
+    """
+    Save both the pid -> path and the path -> pid mappings
+    with a pipeline instead of two round-trips per PID
+    """
+
+    # The same pipeline is flushed every REDIS_BATCH_SIZE PIDs and then reused
+    pipe = r.pipeline(transaction=False)
+    for i, (pid, path) in enumerate(pids, start=1):
+        pipe.set(pid, path)
+        pipe.set(path, pid)
+        if i % REDIS_BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+class EntryTooLargeError(Exception):
+    pass
+
+
+def copy_zip_entry(
+    source: zipfile.ZipFile, info: zipfile.ZipInfo, dest: zipfile.ZipFile
+) -> None:
+    """
+    Copy an entry from a zip into another one as raw compressed bytes:
+    data is neither decompressed nor compressed again, so the size of the
+    entry in dest is the same as in source. ZipFile has no public API for
+    raw copies, the entry is appended the same way ZipFile.write does
+    """
+
+    src = source.fp
+    dst = dest.fp
+    if src is None or dst is None:
+        raise ValueError("Attempt to copy an entry with a closed zip file")
+
+    # Skip the local header of the entry in source, its extra field
+    # can differ from the one in the central directory
+    src.seek(info.header_offset)
+    header = src.read(ZIP_LOCAL_HEADER_SIZE)
+    if header[:4] != ZIP_LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    src.seek(name_length + extra_length, os.SEEK_CUR)
+
+    zinfo = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.comment = info.comment
+    zinfo.create_system = info.create_system
+    zinfo.internal_attr = info.internal_attr
+    zinfo.external_attr = info.external_attr
+    # Sizes and CRC are known: they are written in the local header
+    # and the data descriptor of the source entry is not copied
+    zinfo.flag_bits = info.flag_bits & ~ZIP_DATA_DESCRIPTOR_FLAG
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+
+    dest._writecheck(zinfo)  # type: ignore
+    dest._didModify = True  # type: ignore
+    zinfo.header_offset = dst.tell()
+    dst.write(zinfo.FileHeader())
+
+    remaining = info.compress_size
+    while remaining > 0:
+        data = src.read(min(remaining, ZIP_BUFFER_SIZE))
+        if not data:
+            raise zipfile.BadZipFile(f"Truncated data for {info.filename}")
+        dst.write(data)
+        remaining -= len(data)
+
+    dest.filelist.append(zinfo)
+    dest.NameToInfo[zinfo.filename] = zinfo
+    dest.start_dir = dst.tell()  # type: ignore
+
+
+def split_zip(
+    zip_path: Path, split_path: Path, max_size: int = MAX_ZIP_SIZE
+) -> List[Path]:
+    """
+    In-process replacement of zipsplit: the entries of zip_path are
+    distributed, in order, over as many zips as needed to keep each
+    of them below max_size. Output zips are named <stem>_<index>.zip
+    """
+
+    def entry_size(info: zipfile.ZipInfo) -> int:
+        name_size = len(info.filename.encode("utf-8"))
+        overhead = ZIP_ENTRY_OVERHEAD + 2 * name_size + len(info.comment)
+        return info.compress_size + overhead
+
+    outputs: List[Path] = []
+    with zipfile.ZipFile(zip_path, "r") as source:
+        # End of central directory record, zip64 included
+        available = max_size - 98
+        infolist = source.infolist()
+        for info in infolist:
+            if entry_size(info) > available:
+                raise EntryTooLargeError(info.filename)
+
+        dest: Optional[zipfile.ZipFile] = None
+        current_size = 0
+        try:
+            for info in infolist:
+                size = entry_size(info)
+                if dest is None or current_size + size > available:
+                    if dest is not None:
+                        dest.close()
+                    output = split_path.joinpath(
+                        f"{zip_path.stem}_{len(outputs) + 1}.zip"
+                    )
+                    outputs.append(output)
+                    dest = zipfile.ZipFile(output, "w", allowZip64=True)
+                    current_size = 0
+
+                copy_zip_entry(source, info, dest)
+                current_size += size
+        finally:
+            if dest is not None:
+                dest.close()
+
+    return outputs
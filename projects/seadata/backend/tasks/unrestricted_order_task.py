@@ -1,29 +1,68 @@
 import logging
 import os
-import re
+import time
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from shutil import make_archive, rmtree
-from typing import Any, Dict, List
+from shutil import rmtree
+from typing import Any, Dict, List, Tuple
 
-from plumbum import local  # type: ignore
-from plumbum.commands.processes import ProcessExecutionError  # type: ignore
 from restapi.connectors import redis
 from restapi.connectors.celery import CeleryExt, Task
 from restapi.utilities.logs import log
 from restapi.utilities.processes import start_timeout, stop_timeout
 from seadata.connectors import irods
-from seadata.connectors.b2handle import PIDgenerator, b2handle
+from seadata.connectors.b2handle import PIDgenerator, b2handle, enable_connection_pool
 from seadata.connectors.rabbit_queue import prepare_message
 from seadata.endpoints import MOUNTPOINT, ORDERS_DIR, ErrorCodes
-from seadata.tasks.seadata import MAX_ZIP_SIZE, ext_api, notify_error
+from seadata.tasks.seadata import (
+    MAX_ZIP_SIZE,
+    REDIS_BATCH_SIZE,
+    EntryTooLargeError,
+    cache_pids,
+    error_entry,
+    notify_error,
+    split_zip,
+)
 
 TIMEOUT = 1800
+# Number of files concurrently downloaded from iRODS
+DOWNLOAD_WORKERS = 8
+# Number of PIDs concurrently resolved on B2HANDLE
+PID_WORKERS = 8
+# Seconds between two progress updates sent to the result backend
+UPDATE_STATE_INTERVAL = 0.5
 
 logging.getLogger("b2handle").setLevel(logging.WARNING)
 b2handle_client = b2handle.instantiate_for_read_access()
+# Connections to the handle server are kept alive and shared by the lookup threads
+enable_connection_pool(b2handle_client, PID_WORKERS)
 pmaker = PIDgenerator()
 
 
+def local_size(path: Path) -> int:
+    """
+    Size of a local file, with a single stat. Missing files count as empty
+    """
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def download_file(imain: irods.IrodsPythonExt, ipath: str, local_file: Path) -> None:
+    """
+    Copy a file from irods into the local TMPDIR.
+    It runs in a worker thread: stuck transfers are interrupted
+    by the irods session socket timeout
+    """
+
+    # iRODS streams have no file descriptor usable with
+    # sendfile / copy_file_range: the connector copies them
+    # in large chunks straight into the local file
+    imain.open(ipath, str(local_file))
+
+
 @CeleryExt.task(idempotent=False)
 def unrestricted_order(
     self: Task[[str, str, str, Dict[str, Any]], str],
@@ -57,23 +96,20 @@ def unrestricted_order(
             log.info("Retrieving paths for {} PIDs", len(pids))
             ##################
             # Verify pids
-            files: Dict[str, Path] = {}
+            # iRODS paths are kept as plain strings, as read from the cache
+            files: Dict[str, str] = {}
             errors: List[Dict[str, str]] = []
             counter = 0
             verified = 0
-            for pid in pids:
 
-                ################
-                # avoid empty pids?
-                if "/" not in pid or len(pid) < 10:
-                    continue
+            last_update = 0.0
 
-                ################
-                # Check the cache first
-                ifile = r.get(pid)
-                if ifile is not None:
-                    files[pid] = Path(ifile.decode())
-                    verified += 1
+            def update_progress() -> None:
+                # Progress is sent at most once every UPDATE_STATE_INTERVAL seconds
+                nonlocal last_update
+                now = time.monotonic()
+                if now - last_update >= UPDATE_STATE_INTERVAL:
+                    last_update = now
                     self.update_state(
                         state="PROGRESS",
                         meta={
@@ -83,53 +119,52 @@ def unrestricted_order(
                             "errors": len(errors),
                         },
                     )
-                    continue
 
-                # otherwise b2handle remotely
-                try:
-                    b2handle_output = b2handle_client.retrieve_handle_record(pid)
-                except BaseException:
-                    self.update_state(
-                        state="FAILED",
-                        meta={
-                            "total": total,
-                            "step": counter,
-                            "verified": verified,
-                            "errors": len(errors),
-                        },
-                    )
-                    return notify_error(
-                        ErrorCodes.B2HANDLE_ERROR, myjson, backdoor, self
-                    )
-
-                if b2handle_output is None:
-                    errors.append(
-                        {
-                            "error": ErrorCodes.PID_NOT_FOUND[0],
-                            "description": ErrorCodes.PID_NOT_FOUND[1],
-                            "subject": pid,
-                        }
-                    )
-                    self.update_state(
-                        state="PROGRESS",
-                        meta={"total": total, "step": counter, "errors": len(errors)},
-                    )
-
-                    log.warning("PID not found: {}", pid)
-                else:
-                    pid_path = pmaker.parse_pid_dataobject_path(b2handle_output)
-
-                    if not pid_path:
-                        log.error("Can't extract a PID from {}", b2handle_output)
+            ################
+            # avoid empty pids?
+            valid_pids = [pid for pid in pids if "/" in pid and len(pid) >= 10]
+
+            ################
+            # Check the cache first, with a single round-trip per batch of PIDs
+            missing: List[str] = []
+            for i in range(0, len(valid_pids), REDIS_BATCH_SIZE):
+                chunk = valid_pids[i : i + REDIS_BATCH_SIZE]
+                for pid, ifile in zip(chunk, r.mget(chunk)):
+                    if ifile is None:
+                        missing.append(pid)
                     else:
-                        log.debug("PID verified: {}\n({})", pid, pid_path)
-                        files[pid] = pid_path
-                        r.set(pid, str(pid_path))
-                        r.set(str(pid_path), pid)
-
-                        verified += 1
+                        files[pid] = ifile.decode()
+
+            verified = len(files)
+            self.update_state(
+                state="PROGRESS",
+                meta={
+                    "total": total,
+                    "step": counter,
+                    "verified": verified,
+                    "errors": len(errors),
+                },
+            )
+
+            # otherwise b2handle remotely: lookups are independent HTTP requests,
+            # they run concurrently while their results are handled here
+            new_pids: List[Tuple[str, str]] = []
+            with ThreadPoolExecutor(max_workers=PID_WORKERS) as executor:
+                lookups = {
+                    executor.submit(b2handle_client.retrieve_handle_record, pid): pid
+                    for pid in missing
+                }
+
+                for future in as_completed(lookups):
+
+                    pid = lookups[future]
+                    try:
+                        b2handle_output = future.result()
+                    except BaseException:
+                        # no need to wait for the lookups still queued
+                        executor.shutdown(wait=False, cancel_futures=True)
                         self.update_state(
-                            state="PROGRESS",
+                            state="FAILED",
                             meta={
                                 "total": total,
                                 "step": counter,
@@ -137,68 +172,96 @@ def unrestricted_order(
                                 "errors": len(errors),
                             },
                         )
+                        return notify_error(
+                            ErrorCodes.B2HANDLE_ERROR, myjson, backdoor, self
+                        )
+
+                    if b2handle_output is None:
+                        errors.append(error_entry(ErrorCodes.PID_NOT_FOUND, pid))
+                        update_progress()
+
+                        log.warning("PID not found: {}", pid)
+                    else:
+                        pid_path = pmaker.parse_pid_dataobject_path(b2handle_output)
+
+                        if not pid_path:
+                            log.error("Can't extract a PID from {}", b2handle_output)
+                        else:
+                            log.debug("PID verified: {}\n({})", pid, pid_path)
+                            files[pid] = str(pid_path)
+                            new_pids.append((pid, files[pid]))
+
+                            verified += 1
+                            update_progress()
+
+            # the PIDs resolved remotely are cached with pipelined writes
+            cache_pids(r, new_pids)
             log.info("Retrieved paths for {} PIDs", len(files))
 
             # Recover files
-            for pid, ipath in files.items():
+            # Files left by a previous run of this order are found with a single
+            # directory scan, instead of a stat for each file of the order
+            with os.scandir(local_zip_dir) as entries:
+                staged = {
+                    entry.name
+                    for entry in entries
+                    if entry.is_file() and entry.stat().st_size > 0
+                }
+            if staged:
+                log.info("{} files already downloaded", len(staged))
+
+            # Downloads are independent and network bound: they run concurrently
+            # in a thread pool, while errors and progress are handled here
+            # PIDs whose paths share the same file name have the same local file:
+            # it is downloaded once, and the PIDs share the outcome of the download
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+                targets: Dict[str, "Future[None]"] = {}
+                downloads: Dict["Future[None]", List[str]] = {}
+                for pid, ipath in files.items():
+                    filename = os.path.basename(ipath)
+                    if filename in staged:
+                        counter += 1
+                        continue
+                    future = targets.get(filename)
+                    if future is None:
+                        future = executor.submit(
+                            download_file,
+                            imain,
+                            ipath,
+                            local_zip_dir.joinpath(filename),
+                        )
+                        targets[filename] = future
+                        downloads[future] = []
+                    downloads[future].append(pid)
 
-                # Copy files from irods into a local TMPDIR
-                filename = ipath.name
-                local_file = local_zip_dir.joinpath(filename)
+                # Results are collected in submission order, so that each download
+                # is bounded by TIMEOUT: the socket timeout only bounds each call
+                for future, future_pids in downloads.items():
 
-                if not local_file.exists() or local_file.stat().st_size == 0:
                     try:
-                        start_timeout(TIMEOUT)
-                        with imain.get_dataobject(ipath).open("r") as source:
-                            with open(local_file, "wb") as target:
-                                chunk_size = 10485760
-                                while True:
-                                    data = source.read(chunk_size)
-                                    if not data:
-                                        break
-                                    target.write(data)
-                        stop_timeout()
+                        future.result(timeout=TIMEOUT)
                     except BaseException as e:
-                        log.error(e)
-                        errors.append(
-                            {
-                                "error": ErrorCodes.UNABLE_TO_DOWNLOAD_FILE[0],
-                                "description": ErrorCodes.UNABLE_TO_DOWNLOAD_FILE[1],
-                                "subject_alt": filename,
-                                "subject": pid,
-                            }
-                        )
-                        self.update_state(
-                            state="PROGRESS",
-                            meta={
-                                "total": total,
-                                "step": counter,
-                                "errors": len(errors),
-                            },
-                        )
+                        log.error("Unable to download {}: {}", future_pids, repr(e))
+                        for pid in future_pids:
+                            errors.append(
+                                error_entry(
+                                    ErrorCodes.UNABLE_TO_DOWNLOAD_FILE,
+                                    pid,
+                                    subject_alt=os.path.basename(files[pid]),
+                                )
+                            )
+                        update_progress()
                         continue
 
-                    # log.debug("Copy to local: {}", local_file)
-                #########################
-                #########################
-
-                counter += 1
-                if counter % 1000 == 0:
-                    self.update_state(
-                        state="PROGRESS",
-                        meta={
-                            "total": total,
-                            "step": counter,
-                            "verified": verified,
-                            "errors": len(errors),
-                        },
-                    )
-                    log.info("{} pids already processed", counter)
-                # # Set current file to the metadata collection
-                # if pid not in metadata:
-                #     md = {pid: ipath}
-                #     imain.set_metadata(order_path, **md)
-                #     log.debug("Set metadata")
+                    counter += len(future_pids)
+                    update_progress()
+                    if counter % 1000 == 0:
+                        log.info("{} pids already processed", counter)
+                    # # Set current file to the metadata collection
+                    # if pid not in metadata:
+                    #     md = {pid: ipath}
+                    #     imain.set_metadata(order_path, **md)
+                    #     log.debug("Set metadata")
 
             zip_ipath = None
             if counter > 0:
@@ -206,16 +269,23 @@ def unrestricted_order(
                 # Zip the dir
                 zip_local_file = local_dir.joinpath(zip_file_name)
                 log.debug("Zip local path: {}", zip_local_file)
-                if not zip_local_file.exists() or zip_local_file.stat().st_size == 0:
-                    make_archive(
-                        base_name=str(
-                            zip_local_file.parent.joinpath(zip_local_file.stem)
-                        ),
-                        format="zip",
-                        root_dir=local_zip_dir,
-                    )
+                zip_size = local_size(zip_local_file)
+                if zip_size == 0:
+                    # Data files are mostly already compressed or incompressible:
+                    # storing them makes the zip bound by disk speed, not by CPU
+                    with zipfile.ZipFile(
+                        zip_local_file, "w", zipfile.ZIP_STORED, allowZip64=True
+                    ) as zip_ref:
+                        # a single scandir, entry types come from the dirents
+                        with os.scandir(local_zip_dir) as entries:
+                            local_files = sorted(
+                                entry.name for entry in entries if entry.is_file()
+                            )
+                        for filename in local_files:
+                            zip_ref.write(local_zip_dir.joinpath(filename), filename)
 
                     log.info("Compressed in: {}", zip_local_file)
+                    zip_size = local_size(zip_local_file)
 
                 ##################
                 # Copy the zip into irods
@@ -232,7 +302,7 @@ def unrestricted_order(
                         ErrorCodes.UNEXPECTED_ERROR, myjson, backdoor, self
                     )
 
-                if os.path.getsize(str(zip_local_file)) > MAX_ZIP_SIZE:
+                if zip_size > MAX_ZIP_SIZE:
                     log.warning("Zip too large, splitting {}", zip_local_file)
 
                     # Create a sub folder for split files. If already exists,
@@ -242,34 +312,18 @@ def unrestricted_order(
                     split_path.mkdir()
 
                     # Execute the split of the whole zip
-                    split_params = [
-                        "-n",
-                        MAX_ZIP_SIZE,
-                        "-b",
-                        str(split_path),
-                        zip_local_file,
-                    ]
                     try:
-                        zipsplit = local["/usr/bin/zipsplit"]
-                        zipsplit(split_params)
-                    except ProcessExecutionError as e:
-
-                        if "Entry is larger than max split size" in e.stdout:
-                            reg = r"Entry too big to split, read, or write \((.*)\)"
-                            extra = None
-                            m = re.search(reg, e.stdout)
-                            if m:
-                                extra = m.group(1)
-                            return notify_error(
-                                ErrorCodes.ZIP_SPLIT_ENTRY_TOO_LARGE,
-                                myjson,
-                                backdoor,
-                                self,
-                                extra=extra,
-                            )
-                        else:
-                            log.error(e.stdout)
-
+                        subzip_paths = split_zip(zip_local_file, split_path)
+                    except EntryTooLargeError as e:
+                        return notify_error(
+                            ErrorCodes.ZIP_SPLIT_ENTRY_TOO_LARGE,
+                            myjson,
+                            backdoor,
+                            self,
+                            extra=str(e),
+                        )
+                    except BaseException as e:
+                        log.error(e)
                         return notify_error(
                             ErrorCodes.ZIP_SPLIT_ERROR,
                             myjson,
@@ -278,25 +332,10 @@ def unrestricted_order(
                             extra=str(zip_local_file),
                         )
 
-                    regexp = "^.*[^0-9]([0-9]+).zip$"
-                    zip_files = os.listdir(split_path)
+                    # The parts are returned in order: no need to list the
+                    # split folder and parse the index back from the names
                     base_filename, _ = os.path.splitext(zip_file_name)
-                    for subzip_file in zip_files:
-                        m = re.search(regexp, subzip_file)
-                        if not m:
-                            log.error(
-                                "Cannot extract index from zip name: {}",
-                                subzip_file,
-                            )
-                            return notify_error(
-                                ErrorCodes.INVALID_ZIP_SPLIT_OUTPUT,
-                                myjson,
-                                backdoor,
-                                self,
-                                extra=str(zip_local_file),
-                            )
-                        index = m.group(1).lstrip("0")
-                        subzip_path = split_path.joinpath(subzip_file)
+                    for index, subzip_path in enumerate(subzip_paths, start=1):
 
                         subzip_ifile = f"{base_filename}{index}.zip"
                         subzip_ipath = Path(order_path, subzip_ifile)
@@ -344,8 +383,16 @@ def unrestricted_order(
             if len(errors) > 0:
                 myjson["errors"] = errors
             myjson[reqkey] = self.request.id
-            ret = ext_api.post(myjson, backdoor=backdoor)
-            log.info("CDI IM CALL = {}", ret)
+            # The CDI notification is sent by a dedicated task, retried on
+            # its own, on the notify queue: it is not delayed by the orders
+            # waiting on this worker, that is released for the next order
+            notification = CeleryExt.celery_app.send_task(
+                "notify_cdi",
+                args=[myjson, backdoor],
+                queue="notify",
+                routing_key="notify",
+            )
+            log.info("CDI IM notification queued: {}", notification.id)
 
             ##################
             out = {
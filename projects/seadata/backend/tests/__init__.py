@@ -1,6 +1,7 @@
 import json
+import time
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Union, cast
+from typing import Any, Callable, Dict, List, Optional, Union, cast
 
 from restapi.env import Env
 from restapi.tests import AUTH_URI, BaseTests, FlaskClient
@@ -11,6 +12,11 @@
 
 
 class SeadataTests(BaseTests):
+
+    # Login validates the credentials against iRODS: the token is requested
+    # once and then shared by all the tests of the session
+    auth_headers: Optional[Dict[str, str]] = None
+
     def get_seadata_response(
         self, http_out: Response
     ) -> Union[str, List[Any], Dict[str, Any]]:
@@ -27,6 +33,9 @@ def get_seadata_response(
 
     def login(self, client: FlaskClient) -> Dict[str, str]:
 
+        if SeadataTests.auth_headers is not None:
+            return dict(SeadataTests.auth_headers)
+
         r = client.post(
             f"{AUTH_URI}/b2safeproxy",
             json={"username": IRODS_USER, "password": IRODS_PASSWORD},
@@ -40,7 +49,23 @@ def login(self, client: FlaskClient) -> Dict[str, str]:
         token = data["token"]
         assert token is not None
 
-        return {"Authorization": f"Bearer {token}"}
+        SeadataTests.auth_headers = {"Authorization": f"Bearer {token}"}
+        return dict(SeadataTests.auth_headers)
+
+    @staticmethod
+    def wait_for(
+        condition: Callable[[], bool], timeout: float = 30, interval: float = 0.2
+    ) -> None:
+        """
+        Poll condition until it is satisfied, instead of sleeping for a fixed
+        amount of time while celery tasks are completing
+        """
+
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise AssertionError(f"Condition not satisfied after {timeout}s")
+            time.sleep(interval)
 
     def check_endpoints_input_schema(self, response: Dict[str, Any]) -> None:
         assert "api_function" in response
@@ -1,5 +1,3 @@
-import time
-
 from faker import Faker
 from flask import Flask
 from restapi.env import Env
@@ -118,7 +116,12 @@ def test_01(self, client: FlaskClient, faker: Faker) -> None:
         assert content["status"] == "not_filled"
         assert content["files"] == []
 
-        time.sleep(6)
+        def batch_enabled() -> bool:
+            r = client.get(f"{API_URI}/ingestion/{batch_id}", headers=headers)
+            content = self.get_seadata_response(r)
+            return isinstance(content, dict) and content["status"] == "enabled"
+
+        self.wait_for(batch_enabled)
 
         # GET - valid batch - enabled
         r = client.get(f"{API_URI}/ingestion/{batch_id}", headers=headers)
@@ -158,7 +161,11 @@ def test_01(self, client: FlaskClient, faker: Faker) -> None:
         r = client.delete(f"{API_URI}/ingestion", headers=headers, json=data)
         assert r.status_code == 200
 
-        time.sleep(5)
+        def batch_deleted() -> bool:
+            r = client.get(f"{API_URI}/ingestion/{batch_id}", headers=headers)
+            return r.status_code == 404
+
+        self.wait_for(batch_deleted)
 
         # Verify batch is deleted
         r = client.get(f"{API_URI}/ingestion/{batch_id}", headers=headers)
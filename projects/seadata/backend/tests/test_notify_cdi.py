@@ -0,0 +1,44 @@
+from unittest import mock
+
+import requests
+from restapi.tests import FlaskClient
+from seadata.endpoints import ImportManagerAPI
+from seadata.tasks.notify_cdi_task import MAX_RETRIES, notify_cdi
+from tests.custom import SeadataTests
+
+
+class TestApp(SeadataTests):
+    def test_notify_cdi_retries(self, client: FlaskClient) -> None:
+
+        payload = {"api_function": "order_created", "request_id": "test"}
+
+        # The IM API replies 5xx: post raises, as requested by the task
+        server_error = requests.HTTPError("503 Server Error: Service Unavailable")
+        with mock.patch.object(
+            ImportManagerAPI, "post", side_effect=server_error
+        ) as post, mock.patch("seadata.tasks.notify_cdi_task.log") as log:
+            # eager execution: retries are executed immediately, in sequence
+            result = notify_cdi.apply(args=[payload])
+
+        assert result.failed()
+        assert isinstance(result.result, requests.HTTPError)
+
+        # the first call and then one call for each retry
+        assert post.call_count == MAX_RETRIES + 1
+        for call in post.call_args_list:
+            assert call.kwargs["raise_on_server_error"]
+        # the payload is copied, each attempt is based on the original args
+        assert payload == {"api_function": "order_created", "request_id": "test"}
+
+        assert log.warning.call_count == MAX_RETRIES
+        # the last failure is logged as an error
+        log.error.assert_called_once()
+        assert server_error in log.error.call_args.args
+
+        # Other replies are final and not retried
+        with mock.patch.object(ImportManagerAPI, "post", return_value=False) as post:
+            result = notify_cdi.apply(args=[payload])
+
+        assert result.successful()
+        assert result.result is False
+        post.assert_called_once()
@@ -1,10 +1,21 @@
-import time
-
 from faker import Faker
 from restapi.env import Env
 from restapi.tests import API_URI, FlaskClient
 from tests.custom import SeadataTests
 
+EXPECTED_KEYS = frozenset(
+    {
+        "name",
+        "path",
+        "object_type",
+        "owner",
+        "content_length",
+        "created",
+        "last_modified",
+        "URL",
+    }
+)
+
 
 class TestApp(SeadataTests):
     def test_01(self, client: FlaskClient, faker: Faker) -> None:
@@ -101,7 +112,18 @@ def test_01(self, client: FlaskClient, faker: Faker) -> None:
         # The celery task should still be running...
         assert len(content) == 0
 
-        time.sleep(20)
+        # The first task only copies its zip as the order zip: the listing is
+        # complete when the second one has merged its files into the same zip
+        def order_merged() -> bool:
+            r = client.get(f"{API_URI}/orders/{order_id}", headers=headers)
+            content = self.get_seadata_response(r)
+            return (
+                isinstance(content, list)
+                and len(content) == 1
+                and content[0]["content_length"] > int(file_size)
+            )
+
+        self.wait_for(order_merged)
 
         r = client.get(f"{API_URI}/orders/{order_id}", headers=headers, json=data)
         assert r.status_code == 200
@@ -112,14 +134,8 @@ def test_01(self, client: FlaskClient, faker: Faker) -> None:
         # The celery task should still be running...
         # two files downloaded, but they are merged in a single zip
         assert len(content) == 1
-        assert "name" in content[0]
-        assert "path" in content[0]
-        assert "object_type" in content[0]
-        assert "owner" in content[0]
-        assert "content_length" in content[0]
-        assert "created" in content[0]
-        assert "last_modified" in content[0]
-        assert "URL" in content[0]
+        missing = EXPECTED_KEYS - content[0].keys()
+        assert not missing, f"Missing keys: {missing}"
         assert content[0]["name"] == f"order_{order_id}_restricted.zip"
         assert content[0]["path"] == f"/tempZone/orders/{order_id}"
         assert content[0]["owner"] == Env.get("IRODS_USER", "")
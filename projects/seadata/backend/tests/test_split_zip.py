@@ -0,0 +1,92 @@
+# The raw copies of the zip entries rely on ZipFile internals:
+# these tests pin their behaviour on Python 3.9, as in the backend image
+import zipfile
+from pathlib import Path
+
+import pytest
+from faker import Faker
+from seadata.tasks.seadata import EntryTooLargeError, copy_zip_entry, split_zip
+from tests.custom import SeadataTests
+
+
+class TestApp(SeadataTests):
+    def test_split_zip(self, tmp_path: Path, faker: Faker) -> None:
+
+        # Highly compressed entries: parts are budgeted on the compressed sizes
+        contents = {
+            f"folder/file_{i}.txt": faker.text(max_nb_chars=20000).encode() * 5
+            for i in range(30)
+        }
+        zip_path = tmp_path.joinpath("order.zip")
+        with zipfile.ZipFile(
+            zip_path, "w", zipfile.ZIP_DEFLATED, compresslevel=9
+        ) as zip_ref:
+            zip_ref.writestr("folder/", b"")
+            for name, data in contents.items():
+                zip_ref.writestr(name, data)
+
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            compressed = {i.filename: i.compress_size for i in zip_ref.infolist()}
+
+        max_size = zip_path.stat().st_size // 4
+        split_path = tmp_path.joinpath("split")
+        split_path.mkdir()
+
+        parts = split_zip(zip_path, split_path, max_size=max_size)
+        assert len(parts) >= 4
+        assert [p.name for p in parts] == [
+            f"order_{i}.zip" for i in range(1, len(parts) + 1)
+        ]
+
+        extracted = {}
+        for part in parts:
+            assert part.stat().st_size <= max_size
+            with zipfile.ZipFile(part, "r") as zip_ref:
+                assert zip_ref.testzip() is None
+                for info in zip_ref.infolist():
+                    # entries are copied without being compressed again
+                    assert info.compress_size == compressed[info.filename]
+                    extracted[info.filename] = zip_ref.read(info)
+
+        assert extracted.pop("folder/") == b""
+        assert extracted == contents
+
+        # An entry that can't fit in a part
+        with pytest.raises(EntryTooLargeError):
+            split_zip(zip_path, split_path, max_size=100)
+
+    def test_copy_zip_entry(self, tmp_path: Path, faker: Faker) -> None:
+
+        # Restricted orders merge the entries of a partial zip into the order zip
+        order = {f"order/file_{i}.txt": faker.text().encode() * 10 for i in range(5)}
+        partial = {f"partial/file_{i}.txt": faker.text().encode() for i in range(5)}
+
+        order_path = tmp_path.joinpath("order.zip")
+        with zipfile.ZipFile(order_path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+            for name, data in order.items():
+                zip_ref.writestr(name, data)
+
+        partial_path = tmp_path.joinpath("partial.zip")
+        with zipfile.ZipFile(partial_path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+            zip_ref.writestr("partial/", b"")
+            for name, data in partial.items():
+                zip_ref.writestr(name, data)
+            # written as a stream: sizes and CRC follow the data, in a descriptor
+            with zip_ref.open("partial/streamed.txt", "w") as f:
+                f.write(b"streamed" * 100)
+        partial["partial/streamed.txt"] = b"streamed" * 100
+
+        with zipfile.ZipFile(partial_path, "r") as source:
+            compressed = {i.filename: i.compress_size for i in source.infolist()}
+            with zipfile.ZipFile(order_path, "a") as dest:
+                for info in source.infolist():
+                    copy_zip_entry(source, info, dest)
+
+        with zipfile.ZipFile(order_path, "r") as zip_ref:
+            assert zip_ref.testzip() is None
+            merged = {i.filename: zip_ref.read(i) for i in zip_ref.infolist()}
+            for name, size in compressed.items():
+                assert zip_ref.getinfo(name).compress_size == size
+
+        assert merged.pop("partial/") == b""
+        assert merged == {**order, **partial}
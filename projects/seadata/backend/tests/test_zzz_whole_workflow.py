@@ -1,20 +1,205 @@
-import time
+import io
+import zipfile
+from typing import Any, Dict, List
 
 from faker import Faker
+from flask import Flask
+from restapi.connectors import redis
 from restapi.tests import API_URI, FlaskClient
+from seadata.connectors import irods
+from seadata.tasks.seadata import cache_pids
 from tests.custom import SeadataTests
 
+# Celery tasks downloading and moving real files: more than the default timeout
+TASK_TIMEOUT = 300
+
 
 class TestApp(SeadataTests):
-    def test_01(self, client: FlaskClient, faker: Faker) -> None:
+    def test_01(self, app: Flask, client: FlaskClient, faker: Faker) -> None:
+
+        headers = self.login(client)
+        imain = irods.get_instance()
 
-        time.sleep(1)
-        API_URI
+        batch_id = faker.pystr()
+        order_id = faker.pystr()
+
+        download_path = "https://github.com/rapydo/http-api/archive/"
+        file_name = "v0.6.6.zip"
+        file_checksum = "a2b241be6ff941a7c613d2373e10d316"
+        file_size = "1473570"
 
         # 1 . create a batch
+        parameters: Dict[str, Any] = {
+            "batch_number": batch_id,
+            "file_checksum": file_checksum,
+            "file_size": file_size,
+            "data_file_count": "1",
+            "download_path": download_path,
+            "file_name": file_name,
+        }
+        data = self.get_input_data(
+            request_id=batch_id,
+            api_function="datafiles_download",
+            parameters=parameters,
+        )
+        r = client.post(f"{API_URI}/ingestion/{batch_id}", headers=headers, json=data)
+        assert r.status_code == 200
+
+        def batch_enabled() -> bool:
+            r = client.get(f"{API_URI}/ingestion/{batch_id}", headers=headers)
+            content = self.get_seadata_response(r)
+            return isinstance(content, dict) and content["status"] == "enabled"
+
+        self.wait_for(batch_enabled, timeout=TASK_TIMEOUT)
+
+        r = client.get(f"{API_URI}/ingestion/{batch_id}", headers=headers)
+        assert r.status_code == 200
+        content = self.get_seadata_response(r)
+        assert isinstance(content, dict)
+        assert list(content["files"]) == [file_name]
+        assert content["files"][file_name]["content_length"] == int(file_size)
+
         # 2 . approve the batch
+        metadata = {
+            "cdi_n_code": "1522222",
+            "format_n_code": "541555",
+            "data_format_l24": "CFPOINT",
+            "version": "1",
+            "batch_date": "20210101",
+            "test_mode": "1",
+        }
+        parameters = {"pids": [{"temp_id": file_name, **metadata}]}
+        data = self.get_input_data(
+            request_id=batch_id, api_function="approve", parameters=parameters
+        )
+        r = client.post(
+            f"{API_URI}/ingestion/{batch_id}/approve", headers=headers, json=data
+        )
+        assert r.status_code == 200
+        content = self.get_seadata_response(r)
+        assert isinstance(content, dict)
+        assert "request_id" in content
+
+        # the .meta file is written once the file is copied and its metadata set
+        production_path = f"/tempZone/cloud/{batch_id}/{file_name}"
+        self.wait_for(
+            lambda: imain.is_dataobject(f"{production_path}.meta"),
+            timeout=TASK_TIMEOUT,
+        )
+
+        assert imain.is_dataobject(production_path)
+        assert metadata.items() <= imain.get_metadata(production_path).items()
+
         # 3 . create an order
+        # The backdoor skips the PID registration: the order PID is resolved
+        # through the cache, as if it was assigned during the approval
+        pid = f"21.T12995/{faker.uuid4()}"
+        cache_pids(redis.get_instance().r, [(pid, production_path)])
+
+        parameters = {
+            "order_number": order_id,
+            "file_name": f"order_{order_id}_unrestricted",
+            "pids": [pid],
+            "file_count": 1,
+        }
+        data = self.get_input_data(
+            request_id=order_id,
+            api_function="order_create_zipfile",
+            parameters=parameters,
+        )
+        r = client.post(f"{API_URI}/orders", headers=headers, json=data)
+        assert r.status_code == 200
+        content = self.get_seadata_response(r)
+        assert isinstance(content, dict)
+        assert "request_id" in content
+
+        unrestricted_zip = f"order_{order_id}_unrestricted.zip"
+        restricted_zip = f"order_{order_id}_restricted.zip"
+
+        def order_files() -> List[str]:
+            r = client.get(f"{API_URI}/orders/{order_id}", headers=headers)
+            if r.status_code != 200:
+                return []
+            content = self.get_seadata_response(r)
+            assert isinstance(content, list)
+            return sorted(f["name"] for f in content)
+
+        self.wait_for(lambda: unrestricted_zip in order_files(), timeout=TASK_TIMEOUT)
+
         # 4 . create a restricted order
+        parameters = {
+            "order_number": order_id,
+            "zipfile_name": f"order_{order_id}_restricted",
+            "file_checksum": file_checksum,
+            "file_size": file_size,
+            "data_file_count": "1",
+            "download_path": download_path,
+            "file_name": file_name,
+        }
+        data = self.get_input_data(
+            request_id=order_id,
+            api_function="download_restricted_order",
+            parameters=parameters,
+        )
+        r = client.post(f"{API_URI}/restricted/{order_id}", headers=headers, json=data)
+        assert r.status_code == 200
+
+        self.wait_for(lambda: restricted_zip in order_files(), timeout=TASK_TIMEOUT)
+        assert order_files() == [restricted_zip, unrestricted_zip]
+
         # 5 . download the order
+        r = client.put(f"{API_URI}/orders/{order_id}", headers=headers)
+        assert r.status_code == 200
+        links = self.get_seadata_response(r)
+        assert isinstance(links, list)
+        assert sorted(link["name"] for link in links) == [
+            restricted_zip,
+            unrestricted_zip,
+        ]
+
+        downloaded: Dict[str, zipfile.ZipFile] = {}
+        for link in links:
+            # the url is returned without the protocol and the host is the backend
+            path = link["url"].split("/api/", 1)[1]
+            # not authenticated: the access is granted by the ticket in the url
+            r = client.get(f"{API_URI}/{path}")
+            assert r.status_code == 200
+            assert len(r.data) == link["size"]
+            zip_ref = zipfile.ZipFile(io.BytesIO(r.data))
+            assert zip_ref.testzip() is None
+            downloaded[link["name"]] = zip_ref
+
+        # the unrestricted zip contains the file ordered through its PID
+        unrestricted = downloaded[unrestricted_zip]
+        assert unrestricted.namelist() == [file_name]
+        assert unrestricted.getinfo(file_name).file_size == int(file_size)
+        # the restricted zip is the downloaded zip itself
+        assert len(downloaded[restricted_zip].namelist()) > 0
+
         # 6 . delete the batch
+        parameters = {"batches": [batch_id]}
+        data = self.get_input_data(
+            request_id=batch_id, api_function="delete_batch", parameters=parameters
+        )
+        r = client.delete(f"{API_URI}/ingestion", headers=headers, json=data)
+        assert r.status_code == 200
+
+        def batch_deleted() -> bool:
+            r = client.get(f"{API_URI}/ingestion/{batch_id}", headers=headers)
+            return r.status_code == 404
+
+        self.wait_for(batch_deleted, timeout=TASK_TIMEOUT)
+
         # 7 . delete the order
+        parameters = {"orders": [order_id]}
+        data = self.get_input_data(
+            request_id=order_id, api_function="delete_orders", parameters=parameters
+        )
+        r = client.delete(f"{API_URI}/orders", headers=headers, json=data)
+        assert r.status_code == 200
+
+        def order_deleted() -> bool:
+            r = client.get(f"{API_URI}/orders/{order_id}", headers=headers)
+            return r.status_code == 404
+
+        self.wait_for(order_deleted, timeout=TASK_TIMEOUT)